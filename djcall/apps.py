@@ -23,4 +23,12 @@ class DjcallConfig(apps.AppConfig):
         cron = Cron.objects.filter(caller=caller).first()
         if not cron:
             cron = Cron.objects.create(caller=caller, hour=4, minute=0)
+
+        caller = Caller.objects.filter(callback='djcall.models.reap').first()
+        if not caller:
+            caller = Caller.objects.create(callback='djcall.models.reap')
+
+        cron = Cron.objects.filter(caller=caller).first()
+        if not cron:
+            cron = Cron.objects.create(caller=caller, minute=0)
         Cron.objects.add_crons()
@@ -2,7 +2,7 @@ from crudlfap import crudlfap
 from django_filters import filters
 import django_tables2 as tables
 
-from .models import Call, Caller, Cron
+from .models import Call, Caller, Cron, Rollup
 
 
 crudlfap.Router(
@@ -52,6 +52,27 @@ crudlfap.Router(
     material_icon='access_alarm',
 ).register()
 
+crudlfap.Router(
+    Rollup,
+    material_icon='assessment',
+    views=[
+        crudlfap.ListView.clone(
+            table_fields=[
+                'hour',
+                'callback',
+                'success',
+                'failure',
+                'unspoolable',
+                'wait_max',
+                'run_max',
+            ],
+            search_fields=[
+                'callback',
+            ],
+        ),
+    ],
+).register()
+
 '''
 from crudlfap import crudlfap
 
@@ -1,8 +1,10 @@
 from django.conf import settings
-from django.core.mail import EmailMessage
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
 
 
-def email_send(**kwargs):
+def email_message(**kwargs):
     email = EmailMessage(
         subject=kwargs.get('subject'),
         body=kwargs.get('body'),
@@ -17,4 +19,121 @@ def email_send(**kwargs):
     if 'content_subtype' in kwargs:
         email.content_subtype = kwargs['content_subtype']
 
-    email.send()
+    return email
+
+
+def email_send(**kwargs):
+    email_message(**kwargs).send()
+
+
+def email_send_batch(**kwargs):
+    """
+    Send a list of email_send kwargs, reusing one connection per chunk.
+
+    Return a list with, for each message, True if it was sent or the
+    exception message otherwise. The connection is reset after SMTP or
+    network errors only, and failing to reopen it fails that message.
+
+    If callers is a list of Caller ids, one per message, as set by
+    email_coalesce, then their status is set to success or failure.
+    """
+    messages = kwargs.get('messages', [])
+    chunk_size = kwargs.get('chunk_size', 100)
+    results = []
+
+    for i in range(0, len(messages), chunk_size):
+        connection = get_connection()
+        try:
+            for message in messages[i:i + chunk_size]:
+                results.append(email_send_with(connection, message))
+        finally:
+            email_close(connection)
+
+    if 'callers' in kwargs:
+        email_callers_status(kwargs['callers'], results)
+
+    return results
+
+
+def email_send_with(connection, message):
+    try:
+        email = email_message(**message)
+        email.connection = connection
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+    try:
+        connection.open()  # no-op when already open
+        email.send()
+    except OSError as e:  # includes smtplib.SMTPException
+        email_close(connection)  # reopened by the next message
+        return f'{type(e).__name__}: {e}'
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+    return True
+
+
+def email_close(connection):
+    try:
+        connection.close()
+    except OSError:
+        pass
+
+
+def email_callers_status(callers, results):
+    from .models import Caller
+
+    for status, ok in ((Caller.STATUS_SUCCESS, True),
+                       (Caller.STATUS_FAILURE, False)):
+        Caller.objects.filter(pk__in=[
+            pk for pk, result in zip(callers, results)
+            if (result is True) == ok
+        ]).update(status=status, ended=timezone.now())
+
+
+def email_coalesce(**kwargs):
+    """
+    Replace pending email_send callers with spooled email_send_batch callers.
+
+    Pending callers are those created but never spooled: to have messages
+    coalesced, create their email_send Caller without calling spool(). They
+    are marked as spooled, with the batch caller that sends their message as
+    parent, and get a success or failure status once it's sent.
+
+    It's not scheduled by djcall, add a Cron for it, ie. every minute.
+    """
+    from .models import Caller, DATABASE
+
+    batch_size = kwargs.get('batch_size', 1000)
+    batches = []
+
+    with transaction.atomic(using=DATABASE):
+        callers = Caller.objects.select_for_update().filter(
+            callback='djcall.django.email_send',
+            status=Caller.STATUS_CREATED,
+        ).order_by('pk')
+        callers = list(callers)
+
+        for i in range(0, len(callers), batch_size):
+            chunk = callers[i:i + batch_size]
+            batch = Caller.objects.create(
+                callback='djcall.django.email_send_batch',
+                kwargs=dict(
+                    messages=[caller.kwargs for caller in chunk],
+                    callers=[caller.pk for caller in chunk],
+                    chunk_size=kwargs.get('chunk_size', 100),
+                ),
+            )
+            Caller.objects.filter(
+                pk__in=[caller.pk for caller in chunk]
+            ).update(
+                parent=batch,
+                status=Caller.STATUS_SPOOLED,
+                spooled=timezone.now(),
+            )
+            batches.append(batch)
+
+    for batch in batches:
+        batch.spool()
+
+    return batches
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from djcall.models import Rollup
+
+
+class Command(BaseCommand):
+    help = 'Create missing call rollups from the calls still in the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument(
+            '--rebuild',
+            action='store_true',
+            help='Also recompute existing rollups, losing pruned calls',
+        )
+
+    def handle(self, *args, **options):
+        count = Rollup.objects.backfill(
+            chunk_size=options['chunk_size'],
+            rebuild=options['rebuild'],
+        )
+        self.stdout.write(f'{count} rollups written')
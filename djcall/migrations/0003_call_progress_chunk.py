@@ -0,0 +1,53 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+import picklefield.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0002_caller_signal_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='done',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='call',
+            name='total',
+            field=models.IntegerField(editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='call',
+            name='result',
+            field=picklefield.fields.PickledObjectField(editable=False, null=True, protocol=-1),
+        ),
+        migrations.AlterField(
+            model_name='call',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Created'), (1, 'Spooled'), (2, 'Started'), (3, 'Success'), (5, 'Failure'), (6, 'Unspoolable')], db_index=True, default=0, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='caller',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Created'), (1, 'Spooled'), (2, 'Started'), (3, 'Success'), (4, 'Retrying'), (5, 'Failure'), (6, 'Unspoolable')], db_index=True, default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='Chunk',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.IntegerField()),
+                ('data', picklefield.fields.PickledObjectField(editable=False, null=True, protocol=-1)),
+                ('call', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='djcall.Call')),
+            ],
+            options={
+                'ordering': ('call', 'number'),
+                'unique_together': {('call', 'number')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0003_call_progress_chunk'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caller',
+            name='max_memory',
+            field=models.IntegerField(blank=True, help_text='Megabytes', null=True),
+        ),
+        migrations.AddField(
+            model_name='caller',
+            name='timeout',
+            field=models.IntegerField(blank=True, help_text='Seconds', null=True),
+        ),
+    ]
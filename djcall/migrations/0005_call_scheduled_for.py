@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0004_caller_timeout_max_memory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='scheduled_for',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+    ]
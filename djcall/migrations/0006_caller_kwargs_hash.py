@@ -0,0 +1,22 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0005_call_scheduled_for'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='caller',
+            name='kwargs_hash',
+            field=models.CharField(editable=False, max_length=40, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='caller',
+            index=models.Index(fields=['callback', 'kwargs_hash'], name='djcall_call_callbac_7797b9_idx'),
+        ),
+    ]
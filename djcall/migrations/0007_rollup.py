@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-19 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0006_caller_kwargs_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Rollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('callback', models.CharField(max_length=255)),
+                ('hour', models.DateTimeField(db_index=True)),
+                ('success', models.IntegerField(default=0)),
+                ('failure', models.IntegerField(default=0)),
+                ('unspoolable', models.IntegerField(default=0)),
+                ('wait_sum', models.FloatField(default=0)),
+                ('wait_max', models.FloatField(default=0)),
+                ('run_sum', models.FloatField(default=0)),
+                ('run_max', models.FloatField(default=0)),
+            ],
+            options={
+                'ordering': ('-hour', 'callback'),
+                'unique_together': {('callback', 'hour')},
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.28 on 2026-10-19 03:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0007_rollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Bucket',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('callback', models.CharField(max_length=255, unique=True)),
+                ('tokens', models.FloatField()),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-19 03:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djcall', '0008_bucket'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='call',
+            name='throttled',
+            field=models.BooleanField(default=False, editable=False),
+        ),
+    ]
@@ -1,13 +1,26 @@
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import inspect
 import itertools
 import logging
+import pickle
+import resource
+import signal
+import threading
+import time
 import traceback
 import sys
 
-from django.db import close_old_connections
-from django.db import connection
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connections
 from django.db import models
 from django.db import transaction
 from django.db.models import signals
+from django.db.models.functions import Greatest
 from django.utils import timezone
 from django.utils.module_loading import import_string
 from django.utils.translation import gettext_lazy as _
@@ -23,12 +36,37 @@ except ImportError:
 logger = logging.getLogger('djcall')
 
 
+PROGRESS_INTERVAL = getattr(settings, 'DJCALL_PROGRESS_INTERVAL', 1)
+PROGRESS_CHUNKS = getattr(settings, 'DJCALL_PROGRESS_CHUNKS', 100)
+WATCHDOG_INTERVAL = getattr(settings, 'DJCALL_WATCHDOG_INTERVAL', 1)
+SPOOL_BATCH = getattr(settings, 'DJCALL_SPOOL_BATCH', False)
+CACHE = getattr(settings, 'DJCALL_CACHE', None)
+WAIT_INTERVAL_MIN = getattr(settings, 'DJCALL_WAIT_INTERVAL_MIN', .05)
+WAIT_INTERVAL_MAX = getattr(settings, 'DJCALL_WAIT_INTERVAL_MAX', 2)
+DATABASE = getattr(settings, 'DJCALL_DATABASE', 'default')
+RATE_LIMIT_WAIT = getattr(settings, 'DJCALL_RATE_LIMIT_WAIT', 1)
+
+
 def c(v):
     """Clean a value for logger output"""
     return str(v).strip().replace('\n', ' ').replace('\r', '')[:16].encode(
         'ascii', 'ignore').decode('utf8')
 
 
+def close_old_connections():
+    """
+    Close broken or obsolete connections, like Django does for requests.
+
+    The DJCALL_DATABASE connection is kept open as long as it's usable
+    though, so that spooler processes don't reconnect for every call.
+    """
+    for conn in connections.all():
+        if conn.alias != DATABASE:
+            conn.close_if_unusable_or_obsolete()
+        elif conn.connection is not None and not conn.is_usable():
+            conn.close()
+
+
 def spooler(env):
     """
     uWSGI spooler callback
@@ -38,6 +76,9 @@ def spooler(env):
     args = ', '.join([f'{k}={c(v)}' for k, v in env.items()])
     logger.debug(f'spooler(c({args}))')
 
+    if b'calls' in env:
+        return spooler_batch(env)
+
     pk = env[b'call']
 
     # this is required otherwise some postgresql exceptions blow
@@ -46,14 +87,16 @@ def spooler(env):
     call = Call.objects.filter(pk=pk).first()
 
     success = getattr(uwsgi, 'SPOOL_OK', True)
-    if call:
+    if call and call.throttle():
+        close_old_connections()  # cleanup
+        return success
+    elif call:
         try:
             call.call()
         except:
-            max_attempts = call.caller.max_attempts
             close_old_connections()  # cleanup
 
-            if max_attempts and call.caller.call_set.count() >= max_attempts:
+            if call.caller.attempts_exhausted():
                 return success
             raise  # will trigger retry from uwsgi
     else:
@@ -65,10 +108,269 @@ def spooler(env):
     return success
 
 
+def spooler_batch(env):
+    """
+    uWSGI spooler callback for a spool entry with many calls
+
+    Each call is executed in sequence. Instead of retrying the whole entry,
+    a failed call is spooled again on its own, unless max_attempts is
+    reached, just like spooler() lets uWSGI retry it.
+
+    Only calls still spooled and not deferred are executed: uWSGI replays
+    the whole entry if the spooler dies while executing it, and the others
+    have already run or have an entry of their own.
+    """
+    pks = [int(pk) for pk in env[b'calls'].split(b',')]
+
+    close_old_connections()
+
+    calls = Call.objects.filter(
+        pk__in=pks
+    ).select_related('caller').order_by('pk')
+
+    found = set()
+    for call in calls:
+        found.add(call.pk)
+        if call.status != Call.STATUS_SPOOLED or call.throttled:
+            logger.debug(f'{call.caller} -> Call(id={call.pk}): skipped')
+            continue
+        if call.throttle():
+            continue
+        try:
+            call.call()
+        except Exception:
+            close_old_connections()  # cleanup
+
+            if call.caller.attempts_exhausted():
+                continue
+            uwsgi_spool(call.uwsgi_arg(), [call])
+
+    for pk in set(pks) - found:
+        logger.error(
+            f'Call(id={pk}) not found in db ! removing from uWSGI spooler')
+
+    close_old_connections()  # cleanup
+    return getattr(uwsgi, 'SPOOL_OK', True)
+
+
+def uwsgi_spool(arg, calls):
+    logger.debug(f'uwsgi.spool({arg})')
+    try:
+        uwsgi.spool(arg)
+    except Exception:
+        tt, value, tb = sys.exc_info()
+        exception = '\n'.join(traceback.format_exception(tt, value, tb))
+        for call in calls:
+            call.exception = exception
+            call.save_status('unspoolable')
+        # uwsgi does not seem to reprint logger.exception
+        logger.exception(f'uwsgi.spool({arg}): exception !')
+
+
+class SpoolBuffer:
+    """
+    Calls to spool when the current transaction commits, as few entries.
+
+    One spool entry is written per spooler, priority and at, carrying the
+    ids of all calls spooled for them during the transaction.
+
+    Each call registers an on_commit hook and the first one to run flushes
+    the buffer: a single hook would be lost with a rolled back savepoint,
+    along with the calls spooled in the rest of the transaction. Calls left
+    in the buffer by a rollback are dropped by the next flush.
+
+    Hooks are registered on the default connection, which the caller's
+    transaction is on, even if DJCALL_DATABASE is another alias. In that
+    case though, calls spooled in a rolled back savepoint are still spooled
+    with the rest of the transaction.
+    """
+    local = threading.local()
+
+    def __init__(self):
+        self.calls = dict()
+        self.pending = False
+
+    @classmethod
+    def add(cls, call, arg):
+        buffer = getattr(cls.local, 'buffer', None)
+        if not buffer:
+            buffer = cls.local.buffer = cls()
+        buffer.append(call, arg)
+        transaction.on_commit(buffer)
+
+    def append(self, call, arg):
+        key = tuple(sorted((k, v) for k, v in arg.items() if k != b'call'))
+        self.calls.setdefault(key, []).append(call)
+        self.pending = True
+
+    def __call__(self):
+        if not self.pending:
+            return
+        calls, self.calls, self.pending = self.calls, dict(), False
+
+        # drop the calls which were rolled back with their savepoint, some
+        # databases reuse their ids
+        existing = set(Call.objects.filter(
+            pk__in=[call.pk for batch in calls.values() for call in batch],
+        ).values_list('pk', 'created'))
+
+        for key, batch in calls.items():
+            batch = [c for c in batch if (c.pk, c.created) in existing]
+            if not batch:
+                continue
+            pks = ','.join([str(call.pk) for call in batch])
+            arg = dict(key)
+            arg[b'calls'] = pks.encode('ascii')
+            uwsgi_spool(arg, batch)
+
+
 if uwsgi:
     uwsgi.spooler = spooler
 
 
+def async_run(coro):
+    """Run a coroutine to completion from synchronous code."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def async_iterate(agen):
+    """Iterate over an async generator from synchronous code."""
+    loop = asyncio.new_event_loop()
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(agen.aclose())
+        loop.close()
+
+
+class CallTimeout(Exception):
+    pass
+
+
+class CallMemoryExceeded(Exception):
+    pass
+
+
+def rss():
+    """Return the current resident set size in bytes, None if unknown."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+@contextlib.contextmanager
+def limits(timeout=None, max_memory=None):
+    """
+    Raise CallTimeout or CallMemoryExceeded in the wrapped block on breach.
+
+    timeout is in seconds and max_memory in megabytes of RSS, checked every
+    DJCALL_WATCHDOG_INTERVAL seconds by a SIGALRM timer, which is only
+    possible in the main thread. The timer of an outer limits() block is
+    restored on exit, so that nested calls don't disable it.
+    """
+    if not timeout and not max_memory:
+        yield
+        return
+
+    if (threading.current_thread() is not threading.main_thread()
+            or not hasattr(signal, 'setitimer')):
+        logger.warning(f'limits({timeout}, {max_memory}): cannot enforce')
+        yield
+        return
+
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def watchdog(signum, frame):
+        if deadline and time.monotonic() >= deadline:
+            raise CallTimeout(f'Exceeded timeout of {timeout}s')
+        current = rss() if max_memory else None
+        if current and current > max_memory * 1024 * 1024:
+            raise CallMemoryExceeded(
+                f'Exceeded max_memory of {max_memory}MB: '
+                f'{current // 1024 // 1024}MB'
+            )
+
+    first = min(timeout or WATCHDOG_INTERVAL, WATCHDOG_INTERVAL)
+    previous = signal.signal(signal.SIGALRM, watchdog)
+    entered = time.monotonic()
+    delay, interval = signal.setitimer(
+        signal.ITIMER_REAL, first, WATCHDOG_INTERVAL)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
+        if delay:
+            # restore the outer timer, firing asap if it's overdue
+            remaining = delay - (time.monotonic() - entered)
+            signal.setitimer(
+                signal.ITIMER_REAL, max(remaining, .001), interval)
+
+
+def cacheable(ttl):
+    """
+    Decorate a callback which result only depends on its kwargs.
+
+    Calling or spooling it again with the same kwargs within ttl seconds of
+    a success reuses that call instead of executing the callback.
+    """
+    def decorator(func):
+        func.djcall_cache_ttl = ttl
+        return func
+    return decorator
+
+
+def canonical(value):
+    """Return value with dicts and sets in a stable order, for hashing."""
+    if isinstance(value, dict):
+        items = [(canonical(k), canonical(v)) for k, v in value.items()]
+        return (dict, sorted(items, key=repr))
+    if isinstance(value, (set, frozenset)):
+        return (set, sorted([canonical(v) for v in value], key=repr))
+    if isinstance(value, (list, tuple)):
+        return (type(value), [canonical(v) for v in value])
+    return value
+
+
+def kwargs_hash(kwargs):
+    """
+    Return a hash of kwargs that doesn't depend on dict or set order.
+
+    Other objects are hashed by their pickle, so equal objects which pickle
+    differently will not match.
+    """
+    data = pickle.dumps(canonical(kwargs or dict()), protocol=4)
+    return hashlib.sha1(data).hexdigest()
+
+
+def rate_limit(count, period=1):
+    """
+    Decorate a callback to execute at most count times per period seconds.
+
+    Each execution takes a token from the Bucket of the callback, which is
+    shared by all processes through the database. Calls over the limit are
+    deferred until their token is available, Caller.call() only waits for it
+    up to DJCALL_RATE_LIMIT_WAIT seconds.
+
+    Calls must not be made in a transaction on DJCALL_DATABASE, see
+    BucketManager.acquire().
+    """
+    def decorator(func):
+        func.djcall_rate_limit = (count, period)
+        return func
+    return decorator
+
+
 def get_spooler_path(name):
     if not uwsgi:
         return name
@@ -96,6 +398,33 @@ def prune(**kwargs):
     drop_qs._raw_delete(drop_qs.db)
 
 
+def reap(**kwargs):
+    """
+    Mark as failed the calls left started by crashed processes.
+
+    A call is considered lost when it has been started for longer than its
+    caller timeout, or the timeout kwarg for callers without one, plus grace
+    seconds. Calls claimed without a started time count from their creation.
+    """
+    now = timezone.now()
+    grace = kwargs.get('grace', 60)
+    cutoff = now - datetime.timedelta(seconds=grace)
+    qs = Call.objects.filter(
+        models.Q(started__lt=cutoff)
+        | models.Q(started__isnull=True, created__lt=cutoff),
+        status=Call.STATUS_STARTED,
+    ).select_related('caller')
+
+    for call in qs:
+        timeout = call.caller.timeout or kwargs.get('timeout', 86400)
+        age = (now - (call.started or call.created)).total_seconds()
+        if age < timeout + grace:
+            continue
+        call.exception = f'Reaped: started {int(age)}s ago, lost process ?'
+        call.save_status('failure')
+        logger.warning(f'{call.caller} -> Call(id={call.pk}): reaped')
+
+
 class Metadata(models.Model):
     STATUS_CREATED = 0
     STATUS_SPOOLED = 1
@@ -153,8 +482,8 @@ class Metadata(models.Model):
 
         if commit:
             self.save()
-            if not transaction.get_connection().in_atomic_block:
-                transaction.commit()
+            if not transaction.get_connection(DATABASE).in_atomic_block:
+                transaction.commit(DATABASE)
 
     class Meta:
         abstract = True
@@ -173,6 +502,22 @@ class Caller(Metadata):
     spooler = models.CharField(max_length=100, null=True, blank=True)
     priority = models.IntegerField(null=True, blank=True)
     signal_number = models.IntegerField(null=True, blank=True)
+    timeout = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text=_('Seconds'),
+    )
+    max_memory = models.IntegerField(
+        null=True,
+        blank=True,
+        help_text=_('Megabytes'),
+    )
+    kwargs_hash = models.CharField(max_length=40, null=True, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['callback', 'kwargs_hash']),
+        ]
 
     def __str__(self):
         if hasattr(self.kwargs, 'items'):
@@ -202,42 +547,119 @@ class Caller(Metadata):
     def python_callback_call(self):
         return self.python_callback(**self.kwargs)
 
+    def attempts_exhausted(self, attempts=None):
+        """Return True if a failed call should not be retried by uWSGI."""
+        if attempts is None:
+            attempts = self.call_set.count()
+        return bool(self.max_attempts and attempts >= self.max_attempts)
+
+    def python_callback_attribute(self, name):
+        try:
+            callback = self.python_callback
+        except (ImportError, AttributeError):
+            return None  # let call() record the exception
+        return getattr(callback, name, None)
+
+    @property
+    def cache_ttl(self):
+        return self.python_callback_attribute('djcall_cache_ttl')
+
+    @property
+    def rate_limit(self):
+        return self.python_callback_attribute('djcall_rate_limit')
+
+    @property
+    def cache_key(self):
+        key = f'{self.callback}({self.kwargs_hash})'
+        return 'djcall.' + hashlib.sha1(key.encode('utf8')).hexdigest()
+
+    def cached_call(self):
+        """
+        Return the last successful call within the cacheable callback TTL.
+
+        Look it up in the DJCALL_CACHE cache backend first if configured.
+        Also set kwargs_hash, which is only maintained for cacheable
+        callbacks, before call() and spool() save the caller.
+        """
+        ttl = self.cache_ttl
+        if not ttl:
+            return None
+
+        self.kwargs_hash = kwargs_hash(self.kwargs)
+
+        if CACHE:
+            call = caches[CACHE].get(self.cache_key)
+            if call:
+                return call
+
+        return Call.objects.filter(
+            caller__callback=self.callback,
+            caller__kwargs_hash=self.kwargs_hash,
+            status=Call.STATUS_SUCCESS,
+            ended__gte=timezone.now() - datetime.timedelta(seconds=ttl),
+        ).order_by('-ended').first()
+
     def call(self):
+        call = self.cached_call()
+        if call:
+            return call
+
         if not self.pk:
             self.save()
         call = Call.objects.create(caller=self)
-        call.call()
+        if not call.throttle(block=True):
+            call.call()
         return call
 
-    def spool(self, spooler=None):
+    def spool(self, spooler=None, batch=None, eta=None, countdown=None):
+        """
+        Spool a new call, to execute at eta or in countdown seconds if any.
+
+        A naive eta is in the current time zone if USE_TZ is enabled. Passing
+        both eta and countdown raises ValueError.
+
+        Outside uWSGI, a call scheduled in the future is left spooled for an
+        executor of Call.objects.due(), such as run_due(), otherwise it's
+        executed right away.
+
+        Return a Result handle on the call.
+        """
         logger.debug(f'{self}.spool()')
+        if eta is not None and countdown is not None:
+            raise ValueError('spool() takes either eta or countdown, not both')
+        if eta is not None and settings.USE_TZ and timezone.is_naive(eta):
+            eta = timezone.make_aware(eta)
+
+        cached = self.cached_call()
+        if cached:
+            logger.debug(f'{self}.spool(): cached')
+            return Result(cached)
+
         if spooler:
             self.spooler = spooler
+        if countdown is not None:
+            if not isinstance(countdown, datetime.timedelta):
+                countdown = datetime.timedelta(seconds=countdown)
+            eta = timezone.now() + countdown
         self.save_status('spooled')
-        call = Call.objects.create(caller=self)
+        call = Call.objects.create(
+            caller=self,
+            status=Call.STATUS_SPOOLED,
+            spooled=self.spooled,
+            scheduled_for=eta,
+        )
 
         if uwsgi:
-            arg = {b'call': str(call.pk).encode('ascii')}
-            if self.spooler:
-                arg[b'spooler'] = get_spooler_path(self.spooler)
-            if self.priority:
-                arg[b'priority'] = self.priority
-            def spool():
-                logger.debug(f'uwsgi.spool({arg})')
-                try:
-                    uwsgi.spool(arg)
-                except Exception as e:
-                    tt, value, tb = sys.exc_info()
-                    call.exception = '\n'.join(traceback.format_exception(tt, value, tb))
-                    call.save_status('unspoolable')
-                    logger.exception(f'{self} -> Call(id={call.pk}).spool(): uwsgi.spool exception !')
-                    # uwsgi does not seem to reprint logger.exception
-            transaction.on_commit(spool)
-        else:
+            arg = call.uwsgi_arg()
+            if SPOOL_BATCH if batch is None else batch:
+                SpoolBuffer.add(call, arg)
+            else:
+                transaction.on_commit(lambda: uwsgi_spool(arg, [call]))
+        elif (not eta or eta <= timezone.now()) and not call.throttle():
             call.call()
 
         logger.debug(f'{self}.spool(): success')
-        return self
+        return Result(call)
 
 
 def default_kwargs(sender, instance, **kwargs):
@@ -246,6 +668,34 @@ def default_kwargs(sender, instance, **kwargs):
 signals.post_save.connect(default_kwargs, sender=Caller)
 
 
+class CallManager(models.Manager):
+    def due(self):
+        """Return spooled calls scheduled for now or earlier."""
+        return self.filter(
+            status=Call.STATUS_SPOOLED,
+            scheduled_for__lte=timezone.now(),
+        )
+
+
+def run_due(**kwargs):
+    """Execute due calls, for when there is no uWSGI spooler to do it."""
+    limit = kwargs.get('limit', 100)
+    due = Call.objects.due().order_by('scheduled_for')
+    for call in due.select_related('caller')[:limit]:
+        # claim the call, in case another executor got it meanwhile
+        claimed = Call.objects.filter(
+            pk=call.pk,
+            status=Call.STATUS_SPOOLED,
+        ).update(status=Call.STATUS_STARTED, started=timezone.now())
+        if not claimed or call.throttle():
+            continue
+
+        try:
+            call.call()
+        except Exception:
+            close_old_connections()  # cleanup
+
+
 class Call(Metadata):
     STATUS_CHOICES = (
         (Caller.STATUS_CREATED, _('Created')),
@@ -259,6 +709,14 @@ class Call(Metadata):
     caller = models.ForeignKey(Caller, on_delete=models.CASCADE)
     result = PickledObjectField(null=True, protocol=-1)
     exception = models.TextField(default='', editable=False)
+    done = models.IntegerField(default=0, editable=False)
+    total = models.IntegerField(null=True, editable=False)
+    scheduled_for = models.DateTimeField(
+        null=True,
+        db_index=True,
+        editable=False,
+    )
+    throttled = models.BooleanField(default=False, editable=False)
     status = models.IntegerField(
         choices=STATUS_CHOICES,
         db_index=True,
@@ -273,6 +731,8 @@ class Call(Metadata):
         editable=False,
     )
 
+    objects = CallManager()
+
     def __init__(self, *args, **kwargs):
         if 'caller' not in kwargs and 'callback' in kwargs:
             kwargs['caller'] = Caller(
@@ -290,13 +750,82 @@ class Call(Metadata):
         super().save_status(status, commit=commit)
         self.caller.save_status(status, commit=commit)
 
+        if commit and self.status in Rollup.STATUSES:
+            Rollup.objects.record(self)
+
+    def uwsgi_arg(self):
+        arg = {b'call': str(self.pk).encode('ascii')}
+        if self.caller.spooler:
+            arg[b'spooler'] = get_spooler_path(self.caller.spooler)
+        if self.caller.priority:
+            arg[b'priority'] = self.caller.priority
+        if self.scheduled_for:
+            at = int(self.scheduled_for.timestamp())
+            arg[b'at'] = str(at).encode('ascii')
+        return arg
+
+    def throttle(self, block=False):
+        """
+        Take a token for the rate limit of the callback, if any.
+
+        If the token is only available later, then wait for it if block is
+        True and it's within DJCALL_RATE_LIMIT_WAIT seconds, otherwise defer
+        the call and return True. A deferred call holds its token already so
+        it's not throttled again, and call() saves the reset throttled flag.
+        """
+        if self.throttled:
+            self.throttled = False
+            return False
+
+        rate_limit = self.caller.rate_limit
+        if not rate_limit:
+            return False
+
+        delay = Bucket.objects.acquire(self.caller.callback, *rate_limit)
+        if not delay:
+            return False
+
+        if block and delay <= RATE_LIMIT_WAIT:
+            time.sleep(delay)
+            return False
+
+        self.defer(delay)
+        return True
+
+    def defer(self, delay):
+        """Spool the call again to execute in delay seconds."""
+        logger.debug(f'{self.caller} -> Call(id={self.pk}).defer({delay})')
+        self.status = self.STATUS_SPOOLED
+        self.throttled = True
+        self.scheduled_for = timezone.now() + datetime.timedelta(
+            seconds=delay)
+        Call.objects.filter(pk=self.pk).update(
+            status=self.status,
+            throttled=self.throttled,
+            scheduled_for=self.scheduled_for,
+        )
+        if uwsgi:
+            uwsgi_spool(self.uwsgi_arg(), [self])
+
     def call(self):
         logger.debug(f'{self.caller} -> Call(id={self.pk}).call()')
+        if self.started:
+            # discard the output of a previous attempt
+            self.chunk_set.all().delete()
+            self.done, self.total = 0, None
         self.save_status('started')
 
+        # rollback what the callback did in the default database on failure
         sid = transaction.savepoint()
         try:
-            self.result = self.caller.python_callback_call()
+            with limits(self.caller.timeout, self.caller.max_memory):
+                result = self.caller.python_callback_call()
+                if inspect.iscoroutine(result):
+                    result = async_run(result)
+                if inspect.isgenerator(result) or inspect.isasyncgen(result):
+                    self.stream(result)
+                else:
+                    self.result = result
             transaction.savepoint_commit(sid)
         except Exception as e:
             tt, value, tb = sys.exc_info()
@@ -309,6 +838,396 @@ class Call(Metadata):
         self.save_status('success')
         logger.debug(f'{self.caller} -> Call(id={self.pk}).call(): success')
 
+        ttl = self.caller.cache_ttl
+        if CACHE and ttl:
+            caches[CACHE].set(self.caller.cache_key, self, ttl)
+
+    def stream(self, generator):
+        """
+        Store yielded items as Chunks instead of holding them in memory.
+
+        Chunks and progress are written every DJCALL_PROGRESS_INTERVAL
+        seconds or DJCALL_PROGRESS_CHUNKS chunks, whichever comes first, so
+        that consumers can read partial output with iter_chunks() while the
+        call is still started.
+        """
+        if inspect.isasyncgen(generator):
+            generator = async_iterate(generator)
+
+        chunks = []
+        number = 0
+        flushed = time.monotonic()
+        for item in generator:
+            if isinstance(item, Progress):
+                if item.done is not None:
+                    self.done = item.done
+                if item.total is not None:
+                    self.total = item.total
+            else:
+                chunks.append(Chunk(call=self, number=number, data=item))
+                number += 1
+                self.done += 1
+
+            if (len(chunks) >= PROGRESS_CHUNKS
+                    or time.monotonic() - flushed >= PROGRESS_INTERVAL):
+                self.flush(chunks)
+                chunks = []
+                flushed = time.monotonic()
+
+        self.flush(chunks)
+
+    def flush(self, chunks):
+        Chunk.objects.bulk_create(chunks)
+        Call.objects.filter(pk=self.pk).update(
+            done=self.done,
+            total=self.total,
+        )
+
+    def iter_chunks(self):
+        """Return the data of stored chunks, in order."""
+        qs = self.chunk_set.order_by('number').values_list('data', flat=True)
+        return qs.iterator()
+
+    @property
+    def progress(self):
+        if not self.total:
+            return None
+        return self.done / self.total
+
+
+class CallFailed(Exception):
+    pass
+
+
+class Result:
+    """
+    Handle on a spooled call, to wait for its outcome.
+
+    A failed call is only considered done if uWSGI won't retry it.
+    """
+    READY = (
+        Call.STATUS_SUCCESS,
+        Call.STATUS_FAILURE,
+        Call.STATUS_UNSPOOLABLE,
+    )
+
+    def __init__(self, call):
+        self.call = call
+
+    def __repr__(self):
+        return f'Result(Call(id={self.call.pk}))'
+
+    @property
+    def done(self):
+        if self.call.status != Call.STATUS_FAILURE:
+            return self.call.status in self.READY
+        if not uwsgi:
+            return True
+        # attempts is annotated by poll()
+        attempts = getattr(self.call, 'attempts', None)
+        return self.call.caller.attempts_exhausted(attempts)
+
+    def ready(self):
+        if not self.done:
+            poll([self])
+        return self.done
+
+    def wait(self, timeout=None):
+        return wait_all([self], timeout)
+
+    def result(self, timeout=None):
+        """
+        Wait for the call and return its result.
+
+        Raise TimeoutError if it's still pending after timeout seconds, or
+        CallFailed with the exception of the call if it has failed.
+        """
+        if not self.wait(timeout):
+            raise TimeoutError(f'{self} still pending after {timeout}s')
+        if self.call.status != Call.STATUS_SUCCESS:
+            raise CallFailed(self.call.exception)
+        return self.call.result
+
+
+def poll(results):
+    """
+    Refresh the calls of results that are ready, in one query.
+
+    Return the results still pending.
+    """
+    pending = {result.call.pk: result for result in results
+               if not result.done}
+    if pending:
+        calls = Call.objects.filter(
+            pk__in=pending,
+            status__in=Result.READY,
+        ).select_related('caller').annotate(
+            attempts=models.Count('caller__call'),
+        )
+        for call in calls:
+            pending[call.pk].call = call
+            if pending[call.pk].done:
+                del pending[call.pk]
+    return list(pending.values())
+
+
+def wait_all(results, timeout=None):
+    """
+    Wait for all results for at most timeout seconds.
+
+    Pending calls are polled with one query, at an interval which doubles
+    from DJCALL_WAIT_INTERVAL_MIN up to DJCALL_WAIT_INTERVAL_MAX seconds
+    while no call completes. Return True if all calls are ready.
+    """
+    deadline = time.monotonic() + timeout if timeout is not None else None
+    interval = WAIT_INTERVAL_MIN
+    pending = poll(results)
+    while pending:
+        delay = interval
+        if deadline is not None:
+            delay = min(delay, deadline - time.monotonic())
+            if delay <= 0:
+                break
+        time.sleep(delay)
+
+        count = len(pending)
+        pending = poll(pending)
+        if len(pending) < count:
+            interval = WAIT_INTERVAL_MIN
+        else:
+            interval = min(interval * 2, WAIT_INTERVAL_MAX)
+    return not pending
+
+
+async def async_wait_all(results, timeout=None):
+    """
+    Like wait_all, polling in a thread.
+
+    The thread uses a single database connection, closed when done.
+    """
+    loop = asyncio.get_running_loop()
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    try:
+        deadline = loop.time() + timeout if timeout is not None else None
+        interval = WAIT_INTERVAL_MIN
+        pending = await loop.run_in_executor(executor, poll, results)
+        while pending:
+            delay = interval
+            if deadline is not None:
+                delay = min(delay, deadline - loop.time())
+                if delay <= 0:
+                    break
+            await asyncio.sleep(delay)
+
+            count = len(pending)
+            pending = await loop.run_in_executor(executor, poll, pending)
+            if len(pending) < count:
+                interval = WAIT_INTERVAL_MIN
+            else:
+                interval = min(interval * 2, WAIT_INTERVAL_MAX)
+    finally:
+        await loop.run_in_executor(executor, connections.close_all)
+        executor.shutdown(wait=False)
+    return not pending
+
+
+class Progress:
+    """
+    Yield this from a generator callback to report progress.
+
+    Any other yielded value is stored as a Chunk and counts as one item done.
+    """
+    def __init__(self, done=None, total=None):
+        self.done = done
+        self.total = total
+
+
+class Chunk(models.Model):
+    call = models.ForeignKey(Call, on_delete=models.CASCADE)
+    number = models.IntegerField()
+    data = PickledObjectField(null=True, protocol=-1)
+
+    class Meta:
+        ordering = ('call', 'number')
+        unique_together = ('call', 'number')
+
+
+class RollupManager(models.Manager):
+    def record(self, call):
+        """
+        Add a call that has just reached a final status.
+
+        Every attempt counts, so a failure that uWSGI retries is counted as a
+        failure, and the retry again once it ends.
+        """
+        stats = self.stats()
+        self.add_stats(stats, call)
+        rollup, created = self.get_or_create(
+            callback=call.caller.callback,
+            hour=self.hour(call),
+        )
+        updates = {
+            field: models.F(field) + stats[field]
+            for field in self.model.STATUSES.values()
+            if stats[field]
+        }
+        updates.update(
+            wait_sum=models.F('wait_sum') + stats['wait_sum'],
+            wait_max=Greatest('wait_max', models.Value(stats['wait_max'])),
+            run_sum=models.F('run_sum') + stats['run_sum'],
+            run_max=Greatest('run_max', models.Value(stats['run_max'])),
+        )
+        self.filter(pk=rollup.pk).update(**updates)
+
+    def hour(self, call):
+        end = call.ended or call.spooled or call.created
+        return end.replace(minute=0, second=0, microsecond=0)
+
+    def stats(self):
+        """Return a dict of Rollup field values for no call."""
+        stats = dict.fromkeys(self.model.STATUSES.values(), 0)
+        stats.update(wait_sum=0, wait_max=0, run_sum=0, run_max=0)
+        return stats
+
+    def add_stats(self, stats, call):
+        """
+        Add a call to a dict returned by stats().
+
+        Queue wait is counted from when the call was due, which is later than
+        spooled for calls scheduled or deferred by a rate limit.
+        """
+        stats[self.model.STATUSES[call.status]] += 1
+        if not call.started:
+            return
+
+        queued = call.spooled or call.created
+        if call.scheduled_for:
+            queued = max(queued, call.scheduled_for)
+        wait = max((call.started - queued).total_seconds(), 0)
+        stats['wait_sum'] += wait
+        stats['wait_max'] = max(stats['wait_max'], wait)
+
+        if call.ended:
+            run = (call.ended - call.started).total_seconds()
+            stats['run_sum'] += run
+            stats['run_max'] = max(stats['run_max'], run)
+
+    def backfill(self, chunk_size=1000, rebuild=False):
+        """
+        Create rollups for the hours of calls that are still in the db.
+
+        Calls are read by chunks of chunk_size, and only their aggregates are
+        kept in memory. Existing rollups are left untouched unless rebuild is
+        True: recomputing them would lose the calls which were pruned, and the
+        attempts of retried calls but their last, which record() counted.
+        """
+        calls = Call.objects.filter(
+            status__in=list(self.model.STATUSES),
+        ).select_related('caller').only(
+            'caller__callback', 'status', 'created', 'spooled', 'started',
+            'ended', 'scheduled_for',
+        ).order_by('pk')
+
+        buckets = dict()
+        last = 0
+        while True:
+            chunk = list(calls.filter(pk__gt=last)[:chunk_size])
+            if not chunk:
+                break
+            last = chunk[-1].pk
+            for call in chunk:
+                key = (call.caller.callback, self.hour(call))
+                if key not in buckets:
+                    buckets[key] = self.stats()
+                self.add_stats(buckets[key], call)
+
+        existing = set(self.values_list('callback', 'hour'))
+        count = 0
+        with transaction.atomic(using=DATABASE):
+            for (callback, hour), stats in buckets.items():
+                if (callback, hour) in existing:
+                    if not rebuild:
+                        continue
+                    self.filter(callback=callback, hour=hour).delete()
+                self.create(callback=callback, hour=hour, **stats)
+                count += 1
+
+        return count
+
+
+class Rollup(models.Model):
+    """Counts and durations of call attempts per callback and hour."""
+    STATUSES = {
+        Call.STATUS_SUCCESS: 'success',
+        Call.STATUS_FAILURE: 'failure',
+        Call.STATUS_UNSPOOLABLE: 'unspoolable',
+    }
+
+    callback = models.CharField(max_length=255)
+    hour = models.DateTimeField(db_index=True)
+    success = models.IntegerField(default=0)
+    failure = models.IntegerField(default=0)
+    unspoolable = models.IntegerField(default=0)
+    wait_sum = models.FloatField(default=0)
+    wait_max = models.FloatField(default=0)
+    run_sum = models.FloatField(default=0)
+    run_max = models.FloatField(default=0)
+
+    objects = RollupManager()
+
+    class Meta:
+        ordering = ('-hour', 'callback')
+        unique_together = ('callback', 'hour')
+
+    def __str__(self):
+        return f'{self.callback} {self.hour}'
+
+
+class BucketManager(models.Manager):
+    def acquire(self, callback, count, period):
+        """
+        Take a token from the bucket of a callback.
+
+        The bucket holds up to count tokens, refilled at count per period
+        seconds. Tokens taken in advance make it negative, so that each
+        caller over the limit gets its own slot. Return the number of
+        seconds until the token taken is available, 0 if it's right away.
+
+        The bucket row stays locked until the transaction commits, so this
+        must not be called in a transaction on DJCALL_DATABASE: it would
+        serialize all processes taking a token for the callback until then.
+        """
+        with transaction.atomic(using=DATABASE):
+            bucket, created = self.select_for_update().get_or_create(
+                callback=callback,
+                defaults=dict(tokens=count),
+            )
+            now = timezone.now()
+            elapsed = (now - bucket.updated).total_seconds()
+            bucket.tokens = min(
+                count,
+                bucket.tokens + elapsed * count / period,
+            )
+            bucket.updated = now
+            bucket.tokens -= 1
+            bucket.save()
+
+        if bucket.tokens >= 0:
+            return 0
+        return -bucket.tokens * period / count
+
+
+class Bucket(models.Model):
+    """Token bucket shared by the processes executing a callback."""
+    callback = models.CharField(max_length=255, unique=True)
+    tokens = models.FloatField()
+    updated = models.DateTimeField(default=timezone.now)
+
+    objects = BucketManager()
+
+    def __str__(self):
+        return f'{self.callback}: {self.tokens}'
+
 
 class CronManager(models.Manager):
     def register_signals(self):
@@ -342,7 +1261,7 @@ class CronManager(models.Manager):
 
             signal_number += 1
 
-        transaction.commit()
+        transaction.commit(DATABASE)
         return callers
 
     def add_crons(self):
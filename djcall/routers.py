@@ -0,0 +1,30 @@
+from django.conf import settings
+
+
+class DjcallRouter:
+    """
+    Route djcall models to the DJCALL_DATABASE alias.
+
+    Add 'djcall.routers.DjcallRouter' to DATABASE_ROUTERS to keep the queue
+    traffic away from the application database.
+    """
+    app_label = 'djcall'
+
+    @property
+    def database(self):
+        return getattr(settings, 'DJCALL_DATABASE', 'default')
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == self.app_label:
+            return self.database
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        labels = {obj1._meta.app_label, obj2._meta.app_label}
+        if labels == {self.app_label}:
+            return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == self.app_label:
+            return db == self.database
@@ -0,0 +1,114 @@
+import smtplib
+
+import pytest
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends import locmem
+
+from djcall.django import email_coalesce, email_send_batch
+from djcall.models import Caller
+
+
+class FlakyBackend(locmem.EmailBackend):
+    connects = 0
+    fail_open = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        if FlakyBackend.fail_open:
+            raise OSError('Connection refused')
+        FlakyBackend.connects += 1
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, messages):
+        if messages[0].subject == 'disconnect':
+            raise smtplib.SMTPServerDisconnected('lol')
+        if messages[0].subject == 'down':
+            FlakyBackend.fail_open = True
+            raise smtplib.SMTPServerDisconnected('lol')
+        return super().send_messages(messages)
+
+
+def test_email_send_batch():
+    result = email_send_batch(
+        messages=[
+            dict(subject='a', body='a', to=['a@example.com']),
+            dict(subject='b', body='b', to='not a list'),
+            dict(subject='c', body='c', to=['c@example.com']),
+        ],
+        chunk_size=2,
+    )
+    assert result[0] is True
+    assert result[1].startswith('TypeError')
+    assert result[2] is True
+    assert [m.subject for m in mail.outbox] == ['a', 'c']
+
+
+def test_email_send_batch_reconnect(settings):
+    settings.EMAIL_BACKEND = 'djcall.test_django.FlakyBackend'
+    FlakyBackend.connects = 0
+    FlakyBackend.fail_open = False
+
+    result = email_send_batch(messages=[
+        dict(subject='a', body='a', to=['a@example.com']),
+        dict(subject='b', body='b', to='not a list'),
+        dict(subject='c', body='c', to=['c@example.com']),
+        dict(subject='disconnect', body='', to=['d@example.com']),
+        dict(subject='e', body='e', to=['e@example.com']),
+        dict(subject='down', body='', to=['f@example.com']),
+        dict(subject='g', body='g', to=['g@example.com']),
+    ])
+
+    assert result[:3] == [True, result[1], True]
+    assert result[1].startswith('TypeError')
+    assert result[3] == 'SMTPServerDisconnected: lol'
+    assert result[4] is True
+    assert result[5] == 'SMTPServerDisconnected: lol'
+    assert result[6] == 'OSError: Connection refused'
+    assert FlakyBackend.connects == 2
+    assert [m.subject for m in mail.outbox] == ['a', 'c', 'e']
+
+
+@pytest.mark.django_db(transaction=True)
+def test_email_coalesce():
+    callers = [
+        Caller.objects.create(
+            callback='djcall.django.email_send',
+            kwargs=dict(subject=str(i), body='', to=['a@example.com']),
+        )
+        for i in range(3)
+    ]
+    failing = Caller.objects.create(
+        callback='djcall.django.email_send',
+        kwargs=dict(subject='fail', body='', to='not a list'),
+    )
+
+    with mock.patch('djcall.models.uwsgi'):
+        batches = email_coalesce(batch_size=2)
+
+    assert len(batches) == 2
+    for caller in callers + [failing]:
+        caller.refresh_from_db()
+        assert caller.status == Caller.STATUS_SPOOLED
+        assert caller.parent in batches
+
+    for batch in batches:
+        batch.call_set.get().call()
+
+    assert [m.subject for m in mail.outbox] == ['0', '1', '2']
+    assert batches[0].call_set.get().result == [True, True]
+    for caller in callers:
+        caller.refresh_from_db()
+        assert caller.status == Caller.STATUS_SUCCESS
+    failing.refresh_from_db()
+    assert failing.status == Caller.STATUS_FAILURE
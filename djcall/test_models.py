@@ -1,13 +1,27 @@
+import asyncio
+import datetime
+import time
+
 import pytest
 from unittest import mock
 
-from djcall.models import Call, Caller, Cron, spooler
+from django.db import connection, transaction
+from django.utils import timezone
+
+from djcall.models import (
+    Call, CallFailed, Caller, CallTimeout, Chunk, Cron, Progress, Rollup,
+    async_wait_all, cacheable, close_old_connections, kwargs_hash, limits,
+    rate_limit, reap, run_due, spooler, wait_all
+)
 
 
 def mockito(**kwargs):
     exception = kwargs.get('exception')
     if exception:
         raise exception
+    sleep = kwargs.get('sleep')
+    if sleep:
+        time.sleep(sleep)
     subcalls = kwargs.get('subcalls')
     if subcalls:
         for subcall in subcalls:
@@ -18,6 +32,57 @@ def mockito(**kwargs):
     return kwargs.get('id', None)
 
 
+@cacheable(ttl=60)
+def cached(**kwargs):
+    cached.executions += 1
+    return kwargs['id']
+
+
+cached.executions = 0
+
+
+@rate_limit(2, 60)
+def limited(**kwargs):
+    return kwargs.get('id', None)
+
+
+def flaky(**kwargs):
+    if flaky.failures:
+        flaky.failures -= 1
+        raise Exception('flaky')
+    return kwargs.get('id', None)
+
+
+flaky.failures = 0
+
+
+def generator(**kwargs):
+    yield Progress(total=kwargs['total'])
+    for i in range(kwargs['total']):
+        yield i
+
+
+def flaky_generator(**kwargs):
+    yield Progress(total=3)
+    yield 0
+    yield 1
+    if flaky.failures:
+        flaky.failures -= 1
+        raise Exception('flaky')
+    yield 2
+
+
+def flushing_generator(**kwargs):
+    yield 'a'
+    yield 'b'
+    yield Chunk.objects.count()
+
+
+async def async_generator(**kwargs):
+    for i in range(kwargs['total']):
+        yield i
+
+
 @pytest.mark.django_db(transaction=True)
 def test_call_execute_result():
     call = Caller(
@@ -29,6 +94,54 @@ def test_call_execute_result():
     assert call.caller.status == call.STATUS_SUCCESS
 
 
+@pytest.mark.django_db(transaction=True)
+def test_call_execute_generator():
+    call = Caller(
+        callback='djcall.test_models.generator',
+        kwargs=dict(total=3),
+    ).call()
+    assert call.result is None
+    assert list(call.iter_chunks()) == [0, 1, 2]
+    call.refresh_from_db()
+    assert call.done == 3
+    assert call.progress == 1
+    assert call.status == call.STATUS_SUCCESS
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_execute_generator_flush_chunks():
+    with mock.patch('djcall.models.PROGRESS_CHUNKS', 2):
+        call = Caller(callback='djcall.test_models.flushing_generator').call()
+    assert list(call.iter_chunks()) == ['a', 'b', 2]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_execute_generator_retry():
+    flaky.failures = 1
+    caller = Caller.objects.create(
+        callback='djcall.test_models.flaky_generator',
+    )
+    pk = caller.call_set.create().pk
+    with mock.patch('djcall.models.PROGRESS_CHUNKS', 1):
+        with pytest.raises(Exception):
+            spooler({b'call': pk})
+        spooler({b'call': pk})
+    call = Call.objects.get(pk=pk)
+    assert list(call.iter_chunks()) == [0, 1, 2]
+    assert (call.done, call.total, call.progress) == (3, 3, 1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_execute_async_generator():
+    call = Caller(
+        callback='djcall.test_models.async_generator',
+        kwargs=dict(total=2),
+    ).call()
+    assert list(call.iter_chunks()) == [0, 1]
+    assert call.done == 2
+    assert call.progress is None
+
+
 @pytest.mark.django_db(transaction=True)
 def test_call_execute_exception():
     caller = Caller(
@@ -45,6 +158,103 @@ def test_call_execute_exception():
     assert 'raise exception' in call.exception
 
 
+@pytest.mark.django_db(transaction=True)
+def test_call_cacheable():
+    cached.executions = 0
+    first = Caller(callback='djcall.test_models.cached', kwargs=dict(id=1))
+    first = first.call()
+    second = Caller(callback='djcall.test_models.cached', kwargs=dict(id=1))
+    assert second.call() == first
+    assert not second.pk
+    Caller(callback='djcall.test_models.cached', kwargs=dict(id=2)).call()
+    assert cached.executions == 2
+
+    Call.objects.update(ended=timezone.now() - datetime.timedelta(hours=1))
+    Caller(callback='djcall.test_models.cached', kwargs=dict(id=1)).spool()
+    assert cached.executions == 3
+
+
+def test_kwargs_hash():
+    assert kwargs_hash(dict(a=dict(x=1, y=2), b={1, 2})) == kwargs_hash(
+        dict(b={2, 1}, a=dict(y=2, x=1)))
+    assert kwargs_hash(dict(a=[1, 2])) != kwargs_hash(dict(a=[2, 1]))
+    assert kwargs_hash(dict(a=[1])) != kwargs_hash(dict(a=(1,)))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_kwargs_hash_cacheable_only():
+    call = Caller(callback='djcall.test_models.mockito').call()
+    call.caller.refresh_from_db()
+    assert call.caller.kwargs_hash is None
+    call = Caller(callback='djcall.test_models.cached', kwargs=dict(id=1))
+    call = call.call()
+    call.caller.refresh_from_db()
+    assert call.caller.kwargs_hash == kwargs_hash(dict(id=1))
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_cacheable_backend(django_assert_num_queries):
+    cached.executions = 0
+    with mock.patch('djcall.models.CACHE', 'default'):
+        call = Caller(
+            callback='djcall.test_models.cached',
+            kwargs=dict(id=3),
+        ).call()
+        with django_assert_num_queries(0):
+            assert Caller(
+                callback='djcall.test_models.cached',
+                kwargs=dict(id=3),
+            ).call().pk == call.pk
+    assert cached.executions == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_execute_timeout():
+    caller = Caller(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(sleep=5),
+        timeout=1,
+    )
+    with pytest.raises(CallTimeout):
+        caller.call()
+    call = caller.call_set.last()
+    assert call.status == call.STATUS_FAILURE
+    assert 'CallTimeout: Exceeded timeout of 1s' in call.exception
+
+
+@pytest.mark.django_db(transaction=True)
+def test_reap():
+    caller = Caller.objects.create(callback='lol', timeout=10)
+    lost = caller.call_set.create(
+        status=Call.STATUS_STARTED,
+        started=timezone.now() - datetime.timedelta(seconds=100),
+    )
+    running = caller.call_set.create(
+        status=Call.STATUS_STARTED,
+        started=timezone.now(),
+    )
+    claimed = caller.call_set.create(
+        status=Call.STATUS_STARTED,
+        created=timezone.now() - datetime.timedelta(seconds=100),
+    )
+    reap(grace=0)
+    lost.refresh_from_db()
+    running.refresh_from_db()
+    claimed.refresh_from_db()
+    assert lost.status == Call.STATUS_FAILURE
+    assert lost.exception.startswith('Reaped')
+    assert running.status == Call.STATUS_STARTED
+    assert claimed.status == Call.STATUS_FAILURE
+
+
+def test_limits_nested():
+    with pytest.raises(CallTimeout):
+        with limits(timeout=1):
+            with limits(timeout=10):
+                pass
+            time.sleep(3)
+
+
 @pytest.mark.django_db(transaction=True)
 def test_spool():
     # tests spool() call works outside uwsgi (we're in py.test)
@@ -57,6 +267,205 @@ def test_spool():
         caller.spool()
 
 
+@pytest.mark.django_db(transaction=True)
+def test_spool_countdown():
+    caller = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(id=1),
+    )
+    caller.spool(countdown=60)
+    call = caller.call_set.get()
+    assert call.status == Call.STATUS_SPOOLED
+    assert not Call.objects.due()
+
+    Call.objects.update(scheduled_for=timezone.now())
+    assert list(Call.objects.due()) == [call]
+    run_due()
+    call.refresh_from_db()
+    assert call.status == Call.STATUS_SUCCESS
+    assert call.result == 1
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_eta_naive():
+    caller = Caller.objects.create(callback='djcall.test_models.mockito')
+    eta = datetime.datetime.now() + datetime.timedelta(minutes=10)
+    caller.spool(eta=eta)
+    call = caller.call_set.get()
+    assert call.status == Call.STATUS_SPOOLED
+    assert call.scheduled_for == timezone.make_aware(eta)
+
+    with pytest.raises(ValueError):
+        caller.spool(eta=timezone.now(), countdown=60)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_eta_uwsgi():
+    caller = Caller.objects.create(callback='djcall.test_models.mockito')
+    eta = timezone.now() + datetime.timedelta(minutes=10)
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        caller.spool(eta=eta)
+    call = caller.call_set.get()
+    uwsgi.spool.assert_called_once_with({
+        b'call': str(call.pk).encode('ascii'),
+        b'at': str(int(eta.timestamp())).encode('ascii'),
+    })
+    assert call.scheduled_for == eta
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_result(django_assert_num_queries):
+    callers = [
+        Caller.objects.create(
+            callback='djcall.test_models.mockito',
+            kwargs=dict(id=i),
+        )
+        for i in range(3)
+    ]
+    with mock.patch('djcall.models.uwsgi'):
+        results = [caller.spool() for caller in callers]
+
+    assert not results[0].ready()
+    with pytest.raises(TimeoutError):
+        results[0].result(timeout=.1)
+
+    with django_assert_num_queries(1):
+        assert not wait_all(results, timeout=0)
+
+    for result in results[:2]:
+        Call.objects.get(pk=result.call.pk).call()
+    with django_assert_num_queries(1):
+        assert not wait_all(results, timeout=0)
+    assert results[1].result() == 1
+    assert not results[2].done
+
+    Call.objects.get(pk=results[2].call.pk).call()
+    assert asyncio.run(async_wait_all(results, timeout=1))
+    assert [r.result() for r in results] == [0, 1, 2]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_result_failure():
+    caller = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(exception=Exception('lol')),
+    )
+    with mock.patch('djcall.models.uwsgi'):
+        result = caller.spool()
+    with pytest.raises(Exception):
+        Call.objects.get(pk=result.call.pk).call()
+    with pytest.raises(CallFailed):
+        result.result(timeout=0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_rate_limit():
+    results = [
+        Caller.objects.create(
+            callback='djcall.test_models.limited',
+            kwargs=dict(id=i),
+        ).spool()
+        for i in range(3)
+    ]
+    assert [r.call.status for r in results] == [
+        Call.STATUS_SUCCESS,
+        Call.STATUS_SUCCESS,
+        Call.STATUS_SPOOLED,
+    ]
+    deferred = results[2].call
+    delay = (deferred.scheduled_for - timezone.now()).total_seconds()
+    assert 20 < delay <= 30
+    assert not Call.objects.due()
+
+    # each deferred call gets its own slot, 30s apart
+    more = [
+        Caller.objects.create(
+            callback='djcall.test_models.limited',
+            kwargs=dict(id=i),
+        ).spool().call
+        for i in range(3, 6)
+    ]
+    scheduled = [deferred.scheduled_for] + [c.scheduled_for for c in more]
+    assert scheduled == sorted(set(scheduled))
+    for previous, following in zip(scheduled, scheduled[1:]):
+        assert 29 < (following - previous).total_seconds() < 31
+
+    # a deferred call doesn't take another token when due
+    Call.objects.filter(pk=deferred.pk).update(scheduled_for=timezone.now())
+    run_due()
+    deferred.refresh_from_db()
+    assert deferred.status == Call.STATUS_SUCCESS
+    assert not deferred.throttled
+    Call.objects.filter(pk=deferred.pk).update(
+        status=Call.STATUS_SPOOLED,
+        scheduled_for=results[2].call.scheduled_for,
+    )
+
+    deferred.throttled = False
+    deferred.save()
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        assert spooler({b'call': deferred.pk})
+    arg = uwsgi.spool.call_args[0][0]
+    assert arg[b'call'] == str(deferred.pk).encode('ascii')
+    assert int(arg[b'at']) > time.time() + 20
+    deferred.refresh_from_db()
+    assert deferred.status == Call.STATUS_SPOOLED
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_result_retry():
+    flaky.failures = 1
+    retried = Caller.objects.create(
+        callback='djcall.test_models.flaky',
+        kwargs=dict(id=1),
+    )
+    exhausted = Caller.objects.create(
+        callback='djcall.test_models.flaky',
+        kwargs=dict(id=2),
+        max_attempts=1,
+    )
+    with mock.patch('djcall.models.uwsgi'):
+        results = [retried.spool(), exhausted.spool()]
+
+        with pytest.raises(Exception):
+            Call.objects.get(pk=results[0].call.pk).call()
+        # uwsgi will retry the call since max_attempts isn't reached
+        assert not results[0].wait(timeout=0)
+        Call.objects.get(pk=results[0].call.pk).call()
+        assert results[0].result(timeout=0) == 1
+
+        flaky.failures = 1
+        with pytest.raises(Exception):
+            Call.objects.get(pk=results[1].call.pk).call()
+        with pytest.raises(CallFailed):
+            results[1].result(timeout=0)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_call_rate_limit():
+    with mock.patch('djcall.models.time.sleep') as sleep:
+        calls = [
+            Caller(callback='djcall.test_models.limited', kwargs=dict(id=i))
+            .call()
+            for i in range(3)
+        ]
+    # the token is 30s away, longer than DJCALL_RATE_LIMIT_WAIT
+    assert [call.result for call in calls] == [0, 1, None]
+    assert calls[2].status == Call.STATUS_SPOOLED
+    assert 20 < (
+        calls[2].scheduled_for - timezone.now()).total_seconds() <= 30
+    assert not sleep.called
+
+    with mock.patch('djcall.models.RATE_LIMIT_WAIT', 60):
+        with mock.patch('djcall.models.time.sleep') as sleep:
+            call = Caller(
+                callback='djcall.test_models.limited',
+                kwargs=dict(id=3),
+            ).call()
+    assert call.result == 3
+    assert 50 < sleep.call_args[0][0] <= 60
+
+
 @pytest.mark.django_db(transaction=True)
 def test_uwsgi_spooler():
     # test uwsgi spooler
@@ -72,6 +481,190 @@ def test_uwsgi_spooler():
     assert spooler({b'call': caller.call_set.create().pk})
 
 
+@pytest.mark.django_db(transaction=True)
+def test_uwsgi_spooler_batch():
+    ok = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(id=1),
+    )
+    retried = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(exception=Exception('lol')),
+    )
+    exhausted = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(exception=Exception('lol')),
+        max_attempts=1,
+    )
+    pks = [
+        caller.call_set.create(status=Call.STATUS_SPOOLED).pk
+        for caller in (ok, retried, exhausted)
+    ]
+
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        spooler({b'calls': ','.join(map(str, pks)).encode('ascii')})
+    # like uwsgi retries in spooler(), max_attempts=0 retries forever
+    uwsgi.spool.assert_called_once_with(
+        {b'call': str(pks[1]).encode('ascii')})
+
+    assert ok.call_set.get().status == Call.STATUS_SUCCESS
+    assert retried.call_set.get().status == Call.STATUS_FAILURE
+    assert exhausted.call_set.get().status == Call.STATUS_FAILURE
+
+
+@pytest.mark.django_db(transaction=True)
+def test_uwsgi_spooler_batch_replay():
+    callers = [
+        Caller.objects.create(
+            callback='djcall.test_models.limited',
+            kwargs=dict(id=i),
+        )
+        for i in range(3)
+    ]
+    pks = [
+        caller.call_set.create(status=Call.STATUS_SPOOLED).pk
+        for caller in callers
+    ]
+    env = {b'calls': ','.join(map(str, pks)).encode('ascii')}
+
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        spooler(env)
+        ended = list(Call.objects.order_by('pk').values_list('ended'))
+        # replayed by uwsgi, ie. after the spooler was killed
+        spooler(env)
+
+    # only the third call was deferred, it's not executed by the replay
+    assert uwsgi.spool.call_count == 1
+    assert list(Call.objects.order_by('pk').values_list('ended')) == ended
+    assert [c.status for c in Call.objects.order_by('pk')] == [
+        Call.STATUS_SUCCESS,
+        Call.STATUS_SUCCESS,
+        Call.STATUS_SPOOLED,
+    ]
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_batch():
+    callers = [
+        Caller.objects.create(callback='djcall.test_models.mockito')
+        for i in range(3)
+    ]
+
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        with transaction.atomic():
+            for caller in callers:
+                caller.spool(batch=True)
+            assert not uwsgi.spool.called
+
+        pks = ','.join([str(c.call_set.get().pk) for c in callers])
+        uwsgi.spool.assert_called_once_with({b'calls': pks.encode('ascii')})
+
+
+@pytest.mark.django_db(transaction=True)
+def test_spool_batch_rollback():
+    callers = [
+        Caller.objects.create(callback='djcall.test_models.mockito')
+        for i in range(3)
+    ]
+
+    with mock.patch('djcall.models.uwsgi') as uwsgi:
+        with pytest.raises(Exception):
+            with transaction.atomic():
+                callers[0].spool(batch=True)
+                raise Exception('rollback')
+
+        with transaction.atomic():
+            callers[1].spool(batch=True)
+            try:
+                with transaction.atomic():
+                    callers[2].spool(batch=True)
+                    raise Exception('rollback savepoint')
+            except Exception:
+                pass
+
+        pk = callers[1].call_set.get().pk
+        uwsgi.spool.assert_called_once_with({b'calls': str(pk).encode()})
+
+
+@pytest.mark.django_db(transaction=True)
+def test_close_old_connections():
+    Caller.objects.count()
+    db = connection.connection
+    assert db is not None
+    close_old_connections()
+    assert connection.connection is db
+
+    with mock.patch.object(connection, 'is_usable', return_value=False):
+        with mock.patch.object(connection, 'close') as close:
+            close_old_connections()
+    assert close.called
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rollup():
+    Caller(callback='djcall.test_models.mockito', kwargs=dict(id=1)).call()
+    Caller(callback='djcall.test_models.mockito', kwargs=dict(id=2)).call()
+    with pytest.raises(Exception):
+        Caller(
+            callback='djcall.test_models.mockito',
+            kwargs=dict(exception=Exception('lol')),
+        ).call()
+
+    rollup = Rollup.objects.get()
+    assert rollup.callback == 'djcall.test_models.mockito'
+    assert (rollup.success, rollup.failure) == (2, 1)
+    assert rollup.run_sum >= rollup.run_max >= 0
+
+    Rollup.objects.all().delete()
+    assert Rollup.objects.backfill(chunk_size=2) == 1
+    assert Rollup.objects.values_list('success', 'failure').get() == (2, 1)
+
+    # prune some calls: backfill keeps the history unless rebuilding
+    Call.objects.filter(status=Call.STATUS_SUCCESS).first().delete()
+    assert Rollup.objects.backfill() == 0
+    assert Rollup.objects.values_list('success', 'failure').get() == (2, 1)
+    assert Rollup.objects.backfill(rebuild=True) == 1
+    assert Rollup.objects.values_list('success', 'failure').get() == (1, 1)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rollup_scheduled_wait():
+    caller = Caller.objects.create(callback='djcall.test_models.mockito')
+    caller.spool(countdown=3600)
+    Call.objects.update(
+        spooled=timezone.now() - datetime.timedelta(hours=1),
+        scheduled_for=timezone.now(),
+    )
+    run_due()
+    assert Rollup.objects.get().wait_max < 60
+
+
+@pytest.mark.django_db(transaction=True)
+def test_rollup_uwsgi_retry():
+    flaky.failures = 1
+    caller = Caller.objects.create(callback='djcall.test_models.flaky')
+    pk = caller.call_set.create().pk
+    with mock.patch('djcall.models.uwsgi'):
+        with pytest.raises(Exception):
+            spooler({b'call': pk})
+        spooler({b'call': pk})
+    assert Rollup.objects.values_list('success', 'failure').get() == (1, 1)
+
+    # failures are counted while uwsgi retries them, max_attempts=0 forever
+    caller = Caller.objects.create(
+        callback='djcall.test_models.mockito',
+        kwargs=dict(exception=Exception('lol')),
+    )
+    pks = [caller.call_set.create().pk for i in range(3)]
+    with mock.patch('djcall.models.uwsgi'):
+        for pk in pks:
+            with pytest.raises(Exception):
+                spooler({b'call': pk})
+    assert Rollup.objects.filter(
+        callback='djcall.test_models.mockito',
+    ).values_list('success', 'failure').get() == (0, 3)
+
+
 def test_cron_matrix():
     cron = Cron(
         minute='1-2',
@@ -0,0 +1,46 @@
+import pytest
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from djcall.models import Call, Caller
+from djcall.routers import DjcallRouter
+
+
+def test_router(settings):
+    settings.DJCALL_DATABASE = 'djcall'
+    router = DjcallRouter()
+    assert router.db_for_read(Call) == 'djcall'
+    assert router.db_for_write(Caller) == 'djcall'
+    assert router.db_for_write(User) is None
+    assert router.allow_relation(Call(), Caller())
+    assert router.allow_migrate('djcall', 'djcall')
+    assert not router.allow_migrate('default', 'djcall')
+    assert router.allow_migrate('default', 'auth') is None
+
+
+@pytest.mark.django_db(transaction=True, databases=['default', 'djcall'])
+def test_router_spool(settings):
+    settings.DJCALL_DATABASE = 'djcall'
+    settings.DATABASE_ROUTERS = ['djcall.routers.DjcallRouter']
+    caller = Caller.objects.create(callback='djcall.test_models.mockito')
+
+    with mock.patch('djcall.models.DATABASE', 'djcall'):
+        with mock.patch('djcall.models.uwsgi') as uwsgi:
+            # spooled when the caller's transaction commits, not djcall's
+            with transaction.atomic():
+                caller.spool()
+                caller.spool(batch=True)
+                assert not uwsgi.spool.called
+            assert uwsgi.spool.call_count == 2
+
+            with pytest.raises(Exception):
+                with transaction.atomic():
+                    caller.spool()
+                    caller.spool(batch=True)
+                    raise Exception('rollback')
+            assert uwsgi.spool.call_count == 2
+
+    assert Call.objects.using('djcall').count() == 4
+    assert not Call.objects.using('default').exists()
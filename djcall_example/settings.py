@@ -9,3 +9,6 @@ ROOT_URLCONF = 'djcall_example.urls'
 INSTALLED_APPS += ['djcall']
 
 STATIC_ROOT = 'static'
+
+# djcall tables can be moved there with DJCALL_DATABASE and DjcallRouter
+DATABASES['djcall'] = dict(DATABASES['default'], NAME='djcall.sqlite3')